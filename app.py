@@ -1,15 +1,24 @@
 # 1) IMPORTS
 import os
-import csv, json, uuid, hmac, hashlib, urllib.request, re
+import asyncio, csv, html, sqlite3, time, uuid, hmac, hashlib, re
 from datetime import datetime, timedelta
-from typing import Optional, List, Dict
+from functools import lru_cache
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Optional, List, Dict, Tuple, AsyncIterator
+
+import httpx
 
 from fastapi import FastAPI, Request, HTTPException, Query, Form
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, JSONResponse, HTMLResponse, RedirectResponse, PlainTextResponse
+from fastapi.responses import FileResponse, JSONResponse, HTMLResponse, RedirectResponse, PlainTextResponse, Response, StreamingResponse
 from fastapi.routing import APIRoute
+from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel, Field
 from itsdangerous import URLSafeSerializer
+import orjson
+from openai import AsyncOpenAI
 
 # --- Stripe & Base URL Config + helpers (defensive) ---
 from urllib.parse import urlparse
@@ -21,6 +30,7 @@ SUCC_ENV = (os.getenv("STRIPE_SUCCESS_URL") or "").strip()
 CANC_ENV = (os.getenv("STRIPE_CANCEL_URL") or "").strip()
 
 STRIPE_CURRENCY = (os.getenv("STRIPE_CURRENCY") or "eur").lower()
+STRIPE_SECRET_KEY = os.getenv("STRIPE_SECRET_KEY")
 STRIPE_SUCCESS_URL = SUCC_ENV or f"{BASE_URL}/payment/success?session_id={{CHECKOUT_SESSION_ID}}"
 STRIPE_CANCEL_URL  = CANC_ENV or f"{BASE_URL}/payment/cancelled"
 
@@ -32,9 +42,10 @@ def _validate_urls():
 _validate_urls()  # fail fast with a clear message if something is off
 print("Stripe URLs:", repr(STRIPE_SUCCESS_URL), repr(STRIPE_CANCEL_URL))
 
+@lru_cache(maxsize=1)
 def get_stripe():
     import stripe  # lazy import so local dev won’t crash if not installed yet
-    stripe.api_key = os.getenv("STRIPE_SECRET_KEY")
+    stripe.api_key = STRIPE_SECRET_KEY
     return stripe
 
 def create_checkout_url(amount_cents: int, email: str, description: str, booking_id: str) -> str:
@@ -65,11 +76,18 @@ def create_checkout_url(amount_cents: int, email: str, description: str, booking
 # Environment / Config
 # -------------------------
 NEXA_SERVER_KEY = (os.getenv("NEXA_SERVER_KEY") or "").strip()
+_NEXA_KEY_BYTES = NEXA_SERVER_KEY.encode("utf-8")
 
 # Brevo (HTTP API)
 BREVO_API_KEY = (os.getenv("BREVO_API_KEY") or "").strip()
 SMTP_FROM = (os.getenv("SMTP_FROM") or "").strip()
 NOTIFY_TO = (os.getenv("NOTIFY_TO") or "").strip()
+_BREVO_READY = bool(BREVO_API_KEY and SMTP_FROM and NOTIFY_TO)
+BUSINESS_NAME = os.getenv("BUSINESS_NAME") or "Nexa"
+
+# Customer confirmation email extras
+PROMO_CODE = os.getenv("PROMO_CODE") or "NEXA10"
+PAYMENT_LINK_BASE = (os.getenv("PAYMENT_LINK_BASE") or "").strip()
 
 # Email links signing
 ADMIN_SECRET = (os.getenv("ADMIN_SECRET") or "").strip()
@@ -78,6 +96,8 @@ PUBLIC_BASE_URL = (os.getenv("PUBLIC_BASE_URL") or "").strip()
 # Admin session
 ADMIN_USER = (os.getenv("ADMIN_USER") or "admin").strip()
 ADMIN_PASS = (os.getenv("ADMIN_PASS") or "changeme").strip()
+_ADMIN_USER_BYTES = ADMIN_USER.encode("utf-8")
+_ADMIN_PASS_BYTES = ADMIN_PASS.encode("utf-8")
 SESSION_SECRET = os.getenv("SESSION_SECRET") or "supersecret123"
 serializer = URLSafeSerializer(SESSION_SECRET, salt="admin-session")
 
@@ -89,6 +109,8 @@ BUSINESS_DESC = (os.getenv("BUSINESS_DESC") or
                  "We provide consultations and scheduling for clients in Sofia.").strip()
 
 # Data (ephemeral unless using a Render Disk)
+LEADS_DB = os.getenv("LEADS_DB") or "leads.db"
+# Legacy CSV store; imported into LEADS_DB once if the database is empty
 LEADS_FILE = os.getenv("LEADS_FILE") or "leads.csv"
 CSV_HEADER = [
     "booking_id", "timestamp_utc", "status", "name", "email", "phone",
@@ -98,10 +120,31 @@ CSV_HEADER = [
 BOOKED_STATUSES = {"confirmed"}
 BUSINESS_HOURS = ("09:00", "18:00")
 
+# Browser cache lifetime for /public assets; they aren't fingerprinted, so a
+# bounded max-age (ETag revalidates after) rather than immutable
+STATIC_MAX_AGE = int(os.getenv("STATIC_MAX_AGE") or "86400")  # seconds
+
 # -------------------------
 # App
 # -------------------------
-app = FastAPI(title="Nexa Lead API")
+class ORJSONResponse(JSONResponse):
+    def render(self, content) -> bytes:
+        return orjson.dumps(content)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Torn down in reverse: queued leads/emails drain while the DB and HTTP client are still open
+    await _open_leads_db()
+    await _open_http_clients()
+    await _start_lead_batcher()
+    try:
+        yield
+    finally:
+        await _stop_lead_batcher()
+        await _close_http_clients()
+        await _close_leads_db()
+
+app = FastAPI(title="Nexa Lead API", default_response_class=ORJSONResponse, lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -118,8 +161,8 @@ class Lead(BaseModel):
     email: Optional[str] = None
     phone: str = Field(min_length=5)
     service: str = Field(min_length=1)
-    appointment_date: str  # YYYY-MM-DD
-    appointment_time: str  # HH:MM
+    appointment_date: str = Field(pattern=r"^\d{4}-\d{2}-\d{2}$")  # YYYY-MM-DD
+    appointment_time: str = Field(pattern=r"^([01]\d|2[0-3]):[0-5]\d$")  # HH:MM
 
 class LeadResponse(BaseModel):
     ok: bool
@@ -129,169 +172,391 @@ class LeadResponse(BaseModel):
     confirm_url: Optional[str] = None
     cancel_url: Optional[str] = None
 
+class ChatIn(BaseModel):
+    message: str = ""
+
 # -------------------------
-# CSV helpers
+# Leads store (SQLite)
 # -------------------------
-def _ensure_csv() -> None:
+_TS_SEC = 0
+_TS_STR = ""
+
+def _now_iso() -> str:
+    """UTC timestamp to the second; only re-formatted when the second changes."""
+    global _TS_SEC, _TS_STR
+    sec = int(time.time())
+    if sec != _TS_SEC:
+        _TS_SEC = sec
+        _TS_STR = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(sec))
+    return _TS_STR
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS leads (
+    booking_id TEXT PRIMARY KEY,
+    timestamp_utc TEXT NOT NULL,
+    status TEXT NOT NULL,
+    name TEXT NOT NULL,
+    email TEXT NOT NULL DEFAULT '',
+    phone TEXT NOT NULL,
+    service TEXT NOT NULL,
+    appointment_date TEXT NOT NULL,
+    appointment_time TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_leads_slot ON leads(appointment_date, status, appointment_time);
+"""
+_COLUMNS = ", ".join(CSV_HEADER)
+_INSERT_SQL = f"INSERT OR IGNORE INTO leads ({_COLUMNS}) VALUES ({', '.join('?' * len(CSV_HEADER))})"
+
+_conn: Optional[sqlite3.Connection] = None
+
+def _db() -> sqlite3.Connection:
+    global _conn
+    if _conn is None:
+        conn = sqlite3.connect(LEADS_DB, check_same_thread=False, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        # WAL + NORMAL: commits append to the WAL without an fsync; syncs happen at checkpoints
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        conn.executescript(_SCHEMA)
+        _conn = conn
+        _import_legacy_csv(conn)
+    return _conn
+
+def _import_legacy_csv(conn: sqlite3.Connection) -> None:
     if not os.path.exists(LEADS_FILE):
-        with open(LEADS_FILE, "w", newline="", encoding="utf-8") as f:
-            csv.writer(f).writerow(CSV_HEADER)
-        print(f"📄 Created CSV {LEADS_FILE}")
+        return
+    # IMMEDIATE takes the write lock before the emptiness check, so with several
+    # workers starting at once exactly one of them performs the import
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        if conn.execute("SELECT 1 FROM leads LIMIT 1").fetchone():
+            conn.execute("COMMIT")
+            return
+        with open(LEADS_FILE, "r", newline="", encoding="utf-8") as f:
+            rd = csv.reader(f)
+            _ = next(rd, None)
+            rows = [row[:len(CSV_HEADER)] for row in rd if len(row) >= len(CSV_HEADER)]
+        conn.executemany(_INSERT_SQL, rows)
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    if rows:
+        print(f"📥 Imported {len(rows)} leads from {LEADS_FILE} into {LEADS_DB}")
 
-def _row_to_dict(row: List[str]) -> Dict[str, str]:
-    return {
-        "booking_id": row[0],
-        "timestamp_utc": row[1],
-        "status": row[2],
-        "name": row[3],
-        "email": row[4],
-        "phone": row[5],
-        "service": row[6],
-        "appointment_date": row[7],
-        "appointment_time": row[8],
-    }
+def close_db() -> None:
+    global _conn
+    if _conn is not None:
+        _conn.close()
+        _conn = None
 
 def read_all_leads() -> List[Dict[str, str]]:
-    _ensure_csv()
-    out: List[Dict[str, str]] = []
-    with open(LEADS_FILE, "r", newline="", encoding="utf-8") as f:
-        rd = csv.reader(f)
-        _ = next(rd, None)
-        for row in rd:
-            if not row or len(row) < len(CSV_HEADER):
-                continue
-            out.append(_row_to_dict(row))
-    print(f"📖 Loaded {len(out)} leads from CSV")
-    return out
+    return [dict(r) for r in _db().execute(f"SELECT {_COLUMNS} FROM leads ORDER BY rowid")]
 
-def write_lead(status: str, lead: Lead) -> str:
-    _ensure_csv()
-    booking_id = str(uuid.uuid4())
-    with open(LEADS_FILE, "a", newline="", encoding="utf-8") as f:
-        csv.writer(f).writerow([
-            booking_id,
-            datetime.utcnow().isoformat(),
-            status,
-            lead.name,
-            lead.email or "",
-            lead.phone,
-            lead.service,
-            lead.appointment_date,
-            lead.appointment_time,
+def get_lead(booking_id: str) -> Optional[Dict[str, str]]:
+    r = _db().execute(f"SELECT {_COLUMNS} FROM leads WHERE booking_id = ?", (booking_id,)).fetchone()
+    return dict(r) if r else None
+
+def write_leads_bulk(status: str, leads: List[Lead]) -> List[str]:
+    ts = _now_iso()
+    booking_ids = [str(uuid.uuid4()) for _ in leads]
+    conn = _db()
+    conn.execute("BEGIN")
+    try:
+        conn.executemany(_INSERT_SQL, [
+            (booking_id, ts, status, lead.name, lead.email or "", lead.phone,
+             lead.service, lead.appointment_date, lead.appointment_time)
+            for booking_id, lead in zip(booking_ids, leads)
         ])
-    print(f"📝 Wrote lead {booking_id} {lead.appointment_date} {lead.appointment_time} [{status}]")
-    return booking_id
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    for booking_id, lead in zip(booking_ids, leads):
+        print(f"📝 Wrote lead {booking_id} {lead.appointment_date} {lead.appointment_time} [{status}]")
+    return booking_ids
+
+def write_lead(status: str, lead: Lead) -> str:
+    return write_leads_bulk(status, [lead])[0]
 
 def update_booking_status(booking_id: str, new_status: str) -> bool:
-    if not os.path.exists(LEADS_FILE):
-        return False
-    rows: List[List[str]] = []
-    found = False
-    with open(LEADS_FILE, "r", newline="", encoding="utf-8") as f:
-        rd = csv.reader(f)
-        _ = next(rd, None)
-        for row in rd:
-            if not row:
-                continue
-            if row[0] == booking_id:
-                row[2] = new_status
-                found = True
-            rows.append(row)
-    if not found:
+    cur = _db().execute("UPDATE leads SET status = ? WHERE booking_id = ?", (new_status, booking_id))
+    if cur.rowcount == 0:
         return False
-    with open(LEADS_FILE, "w", newline="", encoding="utf-8") as f:
-        w = csv.writer(f)
-        w.writerow(CSV_HEADER)
-        w.writerows(rows)
     print(f"🔁 Updated {booking_id} -> {new_status}")
     return True
 
-def list_taken_slots_for_date(date_str: str) -> List[str]:
-    taken: List[str] = []
-    for r in read_all_leads():
-        if r["appointment_date"] == date_str and r["status"] in BOOKED_STATUSES:
-            taken.append(r["appointment_time"])
-    return sorted(list(dict.fromkeys(taken)))
+def confirm_if_slot_free(booking_id: str) -> bool:
+    """Confirm in one statement so two workers can't both take the same slot."""
+    cur = _db().execute(
+        """
+        UPDATE leads SET status = 'confirmed'
+        WHERE booking_id = ? AND NOT EXISTS (
+            SELECT 1 FROM leads o
+            WHERE o.appointment_date = leads.appointment_date
+              AND o.appointment_time = leads.appointment_time
+              AND o.status = 'confirmed'
+              AND o.booking_id <> leads.booking_id
+        )
+        """,
+        (booking_id,),
+    )
+    if cur.rowcount == 0:
+        return False
+    print(f"🔁 Updated {booking_id} -> confirmed")
+    return True
+
+_DAY_STATUSES = (*BOOKED_STATUSES, "pending")
+_DAY_SQL = (
+    f"SELECT DISTINCT status, appointment_time FROM leads"
+    f" WHERE appointment_date = ? AND status IN ({', '.join('?' * len(_DAY_STATUSES))})"
+    f" ORDER BY appointment_time"
+)
 
-def list_pending_slots_for_date(date_str: str) -> List[str]:
+def slots_for_date(date_str: str) -> Tuple[List[str], List[str]]:
+    """(taken, pending) for one day from a single indexed query."""
+    taken: List[str] = []
     pending: List[str] = []
-    for r in read_all_leads():
-        if r["appointment_date"] == date_str and r["status"] == "pending":
-            pending.append(r["appointment_time"])
-    return sorted(list(dict.fromkeys(pending)))
+    for status, t in _db().execute(_DAY_SQL, (date_str, *_DAY_STATUSES)):
+        lst = taken if status in BOOKED_STATUSES else pending
+        if not lst or lst[-1] != t:
+            lst.append(t)
+    return taken, pending
+
+async def _open_leads_db():
+    n = _db().execute("SELECT COUNT(*) FROM leads").fetchone()[0]
+    print(f"📖 {n} leads in {LEADS_DB}")
+
+async def _close_leads_db():
+    close_db()
+
+# -------------------------
+# Lead write batching
+# -------------------------
+# Leads arriving within LEAD_BATCH_WINDOW of each other are inserted with one
+# executemany + commit instead of one transaction per request.
+LEAD_BATCH_WINDOW = 0.02  # seconds
+LEAD_BATCH_MAX = 50
+
+def _write_lead_batch(batch: List[Tuple[str, Lead, asyncio.Future]]) -> None:
+    by_status: Dict[str, List[Tuple[Lead, asyncio.Future]]] = {}
+    for status, lead, fut in batch:
+        by_status.setdefault(status, []).append((lead, fut))
+    for status, items in by_status.items():
+        try:
+            booking_ids = write_leads_bulk(status, [lead for lead, _ in items])
+        except Exception as e:
+            print(f"❌ Lead batch write failed: {e}")
+            for _, fut in items:
+                if not fut.done():
+                    fut.set_exception(e)
+            continue
+        for (_, fut), booking_id in zip(items, booking_ids):
+            if not fut.done():
+                fut.set_result(booking_id)
+
+async def _lead_batcher(queue: asyncio.Queue) -> None:
+    loop = asyncio.get_running_loop()
+    while True:
+        batch: List[Tuple[str, Lead, asyncio.Future]] = []
+        try:
+            batch.append(await queue.get())
+            deadline = loop.time() + LEAD_BATCH_WINDOW
+            while len(batch) < LEAD_BATCH_MAX:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+        except asyncio.CancelledError:
+            # flush whatever was already taken off the queue before stopping
+            _write_lead_batch(batch)
+            for _ in batch:
+                queue.task_done()
+            raise
+        _write_lead_batch(batch)
+        for _ in batch:
+            queue.task_done()
+
+async def queue_lead(status: str, lead: Lead) -> str:
+    queue: Optional[asyncio.Queue] = getattr(app.state, "leadq", None)
+    if queue is None:
+        return write_lead(status, lead)
+    fut = asyncio.get_running_loop().create_future()
+    await queue.put((status, lead, fut))
+    return await fut
+
+async def _start_lead_batcher():
+    app.state.leadq = asyncio.Queue()
+    app.state.lead_batcher = asyncio.create_task(_lead_batcher(app.state.leadq))
+
+async def _stop_lead_batcher():
+    queue: asyncio.Queue = app.state.leadq
+    app.state.leadq = None  # from here on queue_lead writes directly
+    try:
+        await asyncio.wait_for(queue.join(), timeout=10)
+    except asyncio.TimeoutError:
+        print(f"❌ Lead batcher still busy at shutdown with {queue.qsize()} queued leads")
+    task: asyncio.Task = app.state.lead_batcher
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    # anything still queued is written here so no request is left waiting on its future
+    leftover = []
+    while not queue.empty():
+        leftover.append(queue.get_nowait())
+    if leftover:
+        _write_lead_batch(leftover)
 
 # -------------------------
 # Token signing
 # -------------------------
+# blake2s keys are capped at 32 bytes; hashing keeps the full secret's entropy
+_SIGN_KEY = hashlib.sha256(ADMIN_SECRET.encode("utf-8")).digest()
+
+def _sign_raw(action: str, booking_id: str) -> bytes:
+    msg = f"{action}:{booking_id}".encode("utf-8")
+    return hashlib.blake2s(msg, key=_SIGN_KEY, digest_size=16).digest()
+
 def _sign(action: str, booking_id: str) -> str:
     if not ADMIN_SECRET:
         return ""
-    msg = f"{action}:{booking_id}".encode("utf-8")
-    return hmac.new(ADMIN_SECRET.encode("utf-8"), msg, hashlib.sha256).hexdigest()
+    return _sign_raw(action, booking_id).hex()
 
 def _verify(action: str, booking_id: str, token: str) -> bool:
     if not ADMIN_SECRET or not token:
         return False
-    expected = _sign(action, booking_id)
-    return hmac.compare_digest(expected, token)
+    try:
+        given = bytes.fromhex(token)
+    except ValueError:
+        return False
+    return hmac.compare_digest(_sign_raw(action, booking_id), given)
+
+# -------------------------
+# Outbound HTTP (shared, keep-alive)
+# -------------------------
+MAIL_QUEUE_MAX = 1000
+HTTP_KEEPALIVE_EXPIRY = 60.0  # seconds
+
+async def _open_http_clients():
+    app.state.http = httpx.AsyncClient(
+        timeout=20,
+        # idle keep-alive sockets are reused for up to a minute
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=HTTP_KEEPALIVE_EXPIRY),
+    )
+    app.state.openai = (
+        AsyncOpenAI(api_key=OPENAI_API_KEY, max_retries=1, timeout=20, http_client=app.state.http)
+        if OPENAI_API_KEY else None
+    )
+    app.state.mailq = asyncio.Queue(maxsize=MAIL_QUEUE_MAX)
+    app.state.mail_worker = asyncio.create_task(_mail_worker(app.state.mailq))
+
+async def _close_http_clients():
+    # let queued emails go out before the client they need is closed
+    try:
+        await asyncio.wait_for(app.state.mailq.join(), timeout=10)
+    except asyncio.TimeoutError:
+        print(f"❌ Shutting down with {app.state.mailq.qsize()} unsent emails")
+    app.state.mailq = None  # from here on queue_email sends via _MAIL_TASKS
+    worker: asyncio.Task = app.state.mail_worker
+    worker.cancel()
+    await asyncio.gather(worker, return_exceptions=True)
+    if _MAIL_TASKS:
+        _, pending = await asyncio.wait(set(_MAIL_TASKS), timeout=10)
+        if pending:
+            print(f"❌ Shutting down with {len(pending)} emails still sending")
+    app.state.openai = None
+    http, app.state.http = app.state.http, None
+    await http.aclose()
 
 # -------------------------
 # Email via Brevo HTTP API
 # -------------------------
-def send_via_brevo_api(subject: str, text: str, html: Optional[str] = None, to_email: Optional[str] = None) -> None:
-    if not BREVO_API_KEY or not (SMTP_FROM and NOTIFY_TO):
+_BREVO_URL = "https://api.brevo.com/v3/smtp/email"
+_BREVO_HEADERS = {
+    "Content-Type": "application/json",
+    "Accept": "application/json",
+    "api-key": BREVO_API_KEY,
+}
+
+async def send_via_brevo_api(subject: str, text: str, html: Optional[str] = None, to_email: Optional[str] = None) -> None:
+    if not _BREVO_READY:
         return
     payload = {
-        "sender": {"email": SMTP_FROM, "name": (os.getenv("BUSINESS_NAME") or "Nexa")},
+        "sender": {"email": SMTP_FROM, "name": BUSINESS_NAME},
         "to": [{"email": (to_email or NOTIFY_TO)}],
         "subject": subject,
         "textContent": text,
     }
     if html:
         payload["htmlContent"] = html
-    req = urllib.request.Request(
-        "https://api.brevo.com/v3/smtp/email",
-        data=json.dumps(payload).encode("utf-8"),
-        headers={
-            "Content-Type": "application/json",
-            "Accept": "application/json",
-            "api-key": BREVO_API_KEY,
-        },
-        method="POST",
-    )
     try:
-        with urllib.request.urlopen(req, timeout=20) as resp:
-            print(f"✅ Brevo email sent: {resp.status}")
+        client: Optional[httpx.AsyncClient] = getattr(app.state, "http", None)
+        if client is None:  # outside the lifespan (scripts, after shutdown): one-off client
+            async with httpx.AsyncClient(timeout=20) as one_off:
+                resp = await one_off.post(_BREVO_URL, content=orjson.dumps(payload), headers=_BREVO_HEADERS)
+        else:
+            resp = await client.post(_BREVO_URL, content=orjson.dumps(payload), headers=_BREVO_HEADERS)
+        resp.raise_for_status()
+        print(f"✅ Brevo email sent: {resp.status_code}")
     except Exception as e:
         print(f"❌ Brevo email failed: {e}")
 
-def build_owner_email(booking_id: str, lead: Lead, confirm_url: str, cancel_url: str):
-    subject = "New Website Lead (pending)"
-    text = (
-        f"Booking ID: {booking_id}\n"
-        f"Name: {lead.name}\n"
-        f"Email: {lead.email or '(not provided)'}\n"
-        f"Phone: {lead.phone}\n"
-        f"Service: {lead.service}\n"
-        f"Date: {lead.appointment_date}\n"
-        f"Time: {lead.appointment_time}\n"
-        f"Status: pending\n\n"
-        "Note: Pending bookings do NOT block the calendar. Only confirmed bookings do.\n\n"
-        "Owner actions:\n"
-        f"✓ Confirm: {confirm_url}\n"
-        f"✕ Cancel:  {cancel_url}\n"
-    )
-    html = f"""
+async def _mail_worker(queue: asyncio.Queue) -> None:
+    while True:
+        msg = await queue.get()
+        try:
+            await send_via_brevo_api(**msg)
+        finally:
+            queue.task_done()
+
+# One-off sends made without the mail worker (no lifespan running)
+_MAIL_TASKS: "set[asyncio.Task]" = set()
+
+def queue_email(subject: str, text: str, html: Optional[str] = None, to_email: Optional[str] = None) -> None:
+    """Hand an email to the background sender; never waits on Brevo."""
+    if not _BREVO_READY:
+        return
+    msg = {"subject": subject, "text": text, "html": html, "to_email": to_email}
+    queue: Optional[asyncio.Queue] = getattr(app.state, "mailq", None)
+    if queue is None:
+        task = asyncio.get_running_loop().create_task(send_via_brevo_api(**msg))
+        _MAIL_TASKS.add(task)  # hold a reference until it finishes
+        task.add_done_callback(_MAIL_TASKS.discard)
+        return
+    try:
+        queue.put_nowait(msg)
+    except asyncio.QueueFull:
+        print(f"❌ Mail queue full, dropping email: {subject} -> {to_email or NOTIFY_TO}")
+
+_OWNER_EMAIL_SUBJECT = "New Website Lead (pending)"
+_OWNER_EMAIL_TEXT = (
+    "Booking ID: {booking_id}\n"
+    "Name: {name}\n"
+    "Email: {email}\n"
+    "Phone: {phone}\n"
+    "Service: {service}\n"
+    "Date: {appointment_date}\n"
+    "Time: {appointment_time}\n"
+    "Status: pending\n\n"
+    "Note: Pending bookings do NOT block the calendar. Only confirmed bookings do.\n\n"
+    "Owner actions:\n"
+    "✓ Confirm: {confirm_url}\n"
+    "✕ Cancel:  {cancel_url}\n"
+)
+_OWNER_EMAIL_HTML = """
     <div style="font-family:Arial,Helvetica,sans-serif;line-height:1.5;color:#0f172a">
       <h2 style="margin:0 0 8px">New Website Lead <small style="color:#64748b">(pending)</small></h2>
       <table style="border-collapse:collapse;margin-top:8px">
         <tr><td style="padding:4px 8px;color:#64748b">Booking ID:</td><td style="padding:4px 8px">{booking_id}</td></tr>
-        <tr><td style="padding:4px 8px;color:#64748b">Name:</td><td style="padding:4px 8px">{lead.name}</td></tr>
-        <tr><td style="padding:4px 8px;color:#64748b">Email:</td><td style="padding:4px 8px">{lead.email or '(not provided)'}</td></tr>
-        <tr><td style="padding:4px 8px;color:#64748b">Phone:</td><td style="padding:4px 8px">{lead.phone}</td></tr>
-        <tr><td style="padding:4px 8px;color:#64748b">Service:</td><td style="padding:4px 8px">{lead.service}</td></tr>
-        <tr><td style="padding:4px 8px;color:#64748b">Date:</td><td style="padding:4px 8px">{lead.appointment_date}</td></tr>
-        <tr><td style="padding:4px 8px;color:#64748b">Time:</td><td style="padding:4px 8px">{lead.appointment_time}</td></tr>
+        <tr><td style="padding:4px 8px;color:#64748b">Name:</td><td style="padding:4px 8px">{name}</td></tr>
+        <tr><td style="padding:4px 8px;color:#64748b">Email:</td><td style="padding:4px 8px">{email}</td></tr>
+        <tr><td style="padding:4px 8px;color:#64748b">Phone:</td><td style="padding:4px 8px">{phone}</td></tr>
+        <tr><td style="padding:4px 8px;color:#64748b">Service:</td><td style="padding:4px 8px">{service}</td></tr>
+        <tr><td style="padding:4px 8px;color:#64748b">Date:</td><td style="padding:4px 8px">{appointment_date}</td></tr>
+        <tr><td style="padding:4px 8px;color:#64748b">Time:</td><td style="padding:4px 8px">{appointment_time}</td></tr>
         <tr><td style="padding:4px 8px;color:#64748b">Status:</td><td style="padding:4px 8px">pending</td></tr>
       </table>
       <div style="margin-top:16px">
@@ -300,62 +565,143 @@ def build_owner_email(booking_id: str, lead: Lead, confirm_url: str, cancel_url:
       </div>
     </div>
     """
-    return subject, text, html
+
+def build_owner_email(booking_id: str, lead: Lead, confirm_url: str, cancel_url: str):
+    fields = {
+        "booking_id": booking_id,
+        "name": lead.name,
+        "email": lead.email or "(not provided)",
+        "phone": lead.phone,
+        "service": lead.service,
+        "appointment_date": lead.appointment_date,
+        "appointment_time": lead.appointment_time,
+        "confirm_url": confirm_url,
+        "cancel_url": cancel_url,
+    }
+    text = _OWNER_EMAIL_TEXT.format_map(fields)
+    html_body = _OWNER_EMAIL_HTML.format_map({k: html.escape(v) for k, v in fields.items()})
+    return _OWNER_EMAIL_SUBJECT, text, html_body
+
+def notify_owner(booking_id: str, lead: Lead) -> Tuple[str, str]:
+    """Queue the owner's confirm/cancel email for a new pending lead; returns the two links."""
+    base = PUBLIC_BASE_URL or ""
+    confirm_url = f"{base}/confirm/{booking_id}?token={_sign('confirm', booking_id)}"
+    cancel_url = f"{base}/cancel/{booking_id}?token={_sign('cancel', booking_id)}"
+    if _BREVO_READY:
+        queue_email(*build_owner_email(booking_id, lead, confirm_url, cancel_url))
+    return confirm_url, cancel_url
+
+# Customer emails sent when the owner confirms or cancels: status -> (subject, text, html)
+_CUSTOMER_EMAIL_HTML = """
+    <div style="font-family:Arial,Helvetica,sans-serif;line-height:1.5;color:#0f172a">
+      <h2 style="margin:0 0 8px">{title}</h2>
+      <p>Hi {name},</p>
+      <p>Your booking for <b>{service}</b> on <b>{appointment_date}</b> at <b>{appointment_time}</b> {verb}.</p>
+      {extra}
+    </div>
+    """
+_CUSTOMER_EMAILS = {
+    "confirmed": (
+        "Your booking is confirmed",
+        "Hi {name},\n\n"
+        "Your booking for {service} on {appointment_date} at {appointment_time} is confirmed.\n"
+        "{extra}",
+        _CUSTOMER_EMAIL_HTML.replace("{title}", "Booking Confirmed").replace("{verb}", "is confirmed"),
+    ),
+    "cancelled": (
+        "Your booking was cancelled",
+        "Hi {name},\n\n"
+        "Your booking for {service} on {appointment_date} at {appointment_time} was cancelled.\n"
+        "{extra}",
+        _CUSTOMER_EMAIL_HTML.replace("{title}", "Booking Cancelled").replace("{verb}", "was cancelled"),
+    ),
+}
+_PAY_TEXT = "Optional: pay now with 10% off using code {promo}: {pay_link}\n"
+_PAY_HTML = '<p><a href="{pay_link}">Pay now with 10% off (code {promo})</a></p>'
+_CANCEL_NOTE_TEXT = "If this is unexpected, reply to this email."
+_CANCEL_NOTE_HTML = "<p>If this is unexpected, reply to this email.</p>"
+
+def build_customer_email(status: str, target: Dict[str, str], pay_link: str = ""):
+    subject, text_tpl, html_tpl = _CUSTOMER_EMAILS[status]
+    fields = {k: target.get(k) or "" for k in ("name", "service", "appointment_date", "appointment_time")}
+    safe = {k: html.escape(v) for k, v in fields.items()}
+    if status == "cancelled":
+        extra_text, extra_html = _CANCEL_NOTE_TEXT, _CANCEL_NOTE_HTML
+    elif pay_link:
+        extra_text = _PAY_TEXT.format(promo=PROMO_CODE, pay_link=pay_link)
+        extra_html = _PAY_HTML.format(promo=html.escape(PROMO_CODE), pay_link=html.escape(pay_link))
+    else:
+        extra_text = extra_html = ""
+    return subject, text_tpl.format_map({**fields, "extra": extra_text}), html_tpl.format_map({**safe, "extra": extra_html})
 
 # -------------------------
 # Admin session helpers
 # -------------------------
 def create_session(user: str) -> str:
-    return serializer.dumps({"user": user, "ts": datetime.utcnow().isoformat()})
+    return serializer.dumps({"user": user, "ts": _now_iso()})
 
-def verify_session(token: str) -> bool:
+# Tokens never expire and the secret/user are fixed for the process lifetime,
+# so a token's validity can be cached instead of re-checking the signature.
+SESSION_TOKEN_MAX_LEN = 512
+
+@lru_cache(maxsize=4096)
+def _verify_session_cached(token: str) -> bool:
     try:
         data = serializer.loads(token)
         return data.get("user") == ADMIN_USER
     except Exception:
         return False
 
+def verify_session(token: str) -> bool:
+    if len(token) > SESSION_TOKEN_MAX_LEN:
+        return False
+    return _verify_session_cached(token)
+
 # -------------------------
 # Middleware (final version)
 # -------------------------
+
+# Path groups for the auth middleware; str.startswith takes the whole tuple at once
+GUARDED_PREFIXES = ("/api", "/admin")
+PUBLIC_API = ("/api/availability", "/api/chat", "/api/chat-contact")
+LEAD_PATHS = ("/api/lead",)
+LEAD_PREFIXES = ("/api/lead/",)
+LOGIN_PATHS = ("/admin/login", "/api/admin/login")
+
 @app.middleware("http")
 async def protect(request: Request, call_next):
     path = request.url.path
 
+    # ---- everything outside /api and /admin (static, links, payments) ----
+    if not path.startswith(GUARDED_PREFIXES):
+        return await call_next(request)
+
     # ---- public endpoints (no auth) ----
-    if (
-        path.startswith("/api/availability")
-        or path.startswith("/api/chat")
-        or path.startswith("/api/chat-contact")
-    ):
+    if path.startswith(PUBLIC_API):
         return await call_next(request)
 
     # ---- public lead submit ONLY for /api/lead (NOT /api/leads) ----
-    if path == "/api/lead" or path.startswith("/api/lead/"):
-        header_key = request.headers.get("X-Nexa-Key", "")
-        if NEXA_SERVER_KEY and header_key != NEXA_SERVER_KEY:
-            return JSONResponse({"detail": "unauthorized"}, status_code=401)
+    if path in LEAD_PATHS or path.startswith(LEAD_PREFIXES):
+        header_key = request.headers.get("X-Nexa-Key", "").encode("utf-8")
+        if NEXA_SERVER_KEY and not hmac.compare_digest(header_key, _NEXA_KEY_BYTES):
+            return ORJSONResponse({"detail": "unauthorized"}, status_code=401)
         return await call_next(request)
 
     # ---- admin login page & login POST are public ----
-    if path.startswith("/admin/login") or path.endswith("/admin/login.html"):
+    if path.startswith(LOGIN_PATHS):
         return await call_next(request)
 
     # ---- all other /api/* require admin session ----
     if path.startswith("/api"):
         session = request.cookies.get("admin_session")
         if not session or not verify_session(session):
-            return JSONResponse({"detail": "unauthorized"}, status_code=401)
+            return ORJSONResponse({"detail": "unauthorized"}, status_code=401)
         return await call_next(request)
 
     # ---- /admin HTML pages redirect to login when no session ----
-    if path.startswith("/admin"):
-        session = request.cookies.get("admin_session")
-        if not session or not verify_session(session):
-            return RedirectResponse(url="/admin/login.html")
-        return await call_next(request)
-
-    # everything else
+    session = request.cookies.get("admin_session")
+    if not session or not verify_session(session):
+        return RedirectResponse(url="/admin/login.html")
     return await call_next(request)
 
 # -------------------------
@@ -365,16 +711,23 @@ async def protect(request: Request, call_next):
 async def root():
     return RedirectResponse(url="/public/index.html", status_code=302)
 
-@app.get("/public/{path:path}")
-async def public_files(path: str):
-    file_path = os.path.join("public", path)
-    if not os.path.isfile(file_path):
-        raise HTTPException(status_code=404, detail="File not found")
-    resp = FileResponse(file_path)
-    if file_path.endswith('.html'):
-        resp.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, max-age=0'
-        resp.headers['Pragma'] = 'no-cache'
-    return resp
+_STATIC_CACHEABLE = (".css", ".js", ".ico", ".png", ".jpg", ".jpeg", ".svg", ".webp", ".woff", ".woff2")
+_STATIC_CACHE_CONTROL = f"public, max-age={STATIC_MAX_AGE}"
+
+class PublicFiles(StaticFiles):
+    """StaticFiles that keeps HTML pages out of browser caches and lets browsers keep assets."""
+
+    def file_response(self, full_path, stat_result, scope, status_code=200):
+        resp = super().file_response(full_path, stat_result, scope, status_code)
+        path = str(full_path)
+        if path.endswith(".html"):
+            resp.headers["Cache-Control"] = "no-store, no-cache, must-revalidate, max-age=0"
+            resp.headers["Pragma"] = "no-cache"
+        elif path.endswith(_STATIC_CACHEABLE):
+            resp.headers["Cache-Control"] = _STATIC_CACHE_CONTROL
+        return resp
+
+app.mount("/public", PublicFiles(directory="public", html=True), name="public")
 
 @app.get("/admin/login.html", response_class=HTMLResponse)
 async def admin_login_page():
@@ -385,8 +738,7 @@ async def admin_login_page():
 
 @app.get("/api/availability")
 async def availability(date: str = Query(..., description="YYYY-MM-DD")):
-    taken = list_taken_slots_for_date(date)
-    pending = list_pending_slots_for_date(date)
+    taken, pending = slots_for_date(date)
     return {
         "date": date,
         "taken": taken,
@@ -396,9 +748,9 @@ async def availability(date: str = Query(..., description="YYYY-MM-DD")):
 
 @app.post("/api/lead", response_model=LeadResponse)
 async def create_lead(lead: Lead):
-    taken = list_taken_slots_for_date(lead.appointment_date)
+    taken, _ = slots_for_date(lead.appointment_date)
     if lead.appointment_time in taken:
-        return JSONResponse(
+        return ORJSONResponse(
             status_code=409,
             content={
                 "ok": False,
@@ -408,15 +760,8 @@ async def create_lead(lead: Lead):
             },
         )
 
-    booking_id = write_lead("pending", lead)
-    confirm_token = _sign("confirm", booking_id)
-    cancel_token = _sign("cancel", booking_id)
-    base = PUBLIC_BASE_URL or ""
-    confirm_url = f"{base}/confirm/{booking_id}?token={confirm_token}"
-    cancel_url = f"{base}/cancel/{booking_id}?token={cancel_token}"
-
-    subject, text, html = build_owner_email(booking_id, lead, confirm_url, cancel_url)
-    send_via_brevo_api(subject, text, html)
+    booking_id = await queue_lead("pending", lead)
+    confirm_url, cancel_url = notify_owner(booking_id, lead)
 
     return {
         "ok": True,
@@ -431,25 +776,15 @@ async def confirm_booking(booking_id: str, token: str):
     if not _verify("confirm", booking_id, token):
         return HTMLResponse("<h2>Invalid or expired confirmation link.</h2>", status_code=403)
 
-    leads = read_all_leads()
-    target = next((r for r in leads if r["booking_id"] == booking_id), None)
+    target = get_lead(booking_id)
     if not target:
         return HTMLResponse("<h2>Booking not found.</h2>", status_code=404)
 
     if target["status"] == "confirmed":
         return HTMLResponse("<h2>✅ Already confirmed.</h2>")
 
-    for r in leads:
-        if (
-            r["booking_id"] != booking_id
-            and r["appointment_date"] == target["appointment_date"]
-            and r["appointment_time"] == target["appointment_time"]
-            and r["status"] == "confirmed"
-        ):
-            return HTMLResponse("<h2>⚠️ Slot already confirmed for another booking.</h2>", status_code=409)
-
-    if not update_booking_status(booking_id, "confirmed"):
-        return HTMLResponse("<h2>Booking not found.</h2>", status_code=404)
+    if not confirm_if_slot_free(booking_id):
+        return HTMLResponse("<h2>⚠️ Slot already confirmed for another booking.</h2>", status_code=409)
     return HTMLResponse("<h2>✅ Booking confirmed. This slot is now reserved.</h2>")
 
 @app.get("/cancel/{booking_id}", response_class=HTMLResponse)
@@ -498,191 +833,268 @@ def list_routes():
 # -------------------------
 # Chatbot (public)
 # -------------------------
-DATE_RX = re.compile(r"\b(20\d{2}-\d{2}-\d{2})\b")
-TIME_RX = re.compile(r"\b([01]\d|2[0-3]):([0-5]\d)\b")
+# ISO date, HH:MM and today/tomorrow in one pass; see _scan_when()
+WHEN_RX = re.compile(
+    r"\b(?P<date>20\d{2}-\d{2}-\d{2})\b"
+    r"|\b(?P<time>(?:[01]\d|2[0-3]):[0-5]\d)\b"
+    r"|(?P<today>today)"
+    r"|(?P<tomorrow>tomorrow|tmrw)",
+    re.IGNORECASE,
+)
+NAME_RX = re.compile(r"(?:i am|i'm|name is)\s+([^\.,\n]+)|\bname\s*:\s*([^\.,\n]+)")
+PHONE_RX = re.compile(r"(?:phone|tel|mobile|gsm)\s*[:\-]?\s*([\+\d][\d\s\-]{6,})")
+SERVICE_RX = re.compile(r"(?:service|for|need|want)\s+([a-zA-Zа-яА-Я0-9 \-_/]{2,})")
+
+EMPTY_TEXT = "Hey! I can check availability, pencil you in, or answer quick questions. Try: ‘availability today’ or ‘book me tomorrow at 10:00’."
+GREETING_TEXT = "Hi there! 👋 I can check availability, help you book, or answer quick questions. What can I do for you today?"
+HELP_TEXT = (
+    "I can check availability or tentatively book you.\n"
+    "• availability today / tomorrow\n"
+    "• availability 2025-10-05\n"
+    "• book me for consultation tomorrow at 14:30, I'm Alex, phone +359…\n"
+    "You can also say “talk to an agent”."
+)
+
+# Keyword -> intent, matched in a single pass over the lowercased message.
+# Keyword order within an intent doesn't matter; FAQ_REPLIES order is the priority.
+_INTENT_KEYWORDS = {
+    "greet": ["hello", "hi ", "hey", "good morning", "good afternoon", "good evening"],
+    "about": ["what kind of business", "who are you", "what is this", "what do you do"],
+    "hours": ["hour", "open", "close", "working"],
+    "location": ["where", "address", "location", "office"],
+    "services": ["service", "offer"],
+    "pricing": ["price", "cost", "fee"],
+    "human": ["human", "agent", "person", "contact"],
+    "avail": ["avail", "free", "slot"],
+    "book": ["book", "schedule", "appointment"],
+}
+INTENT_RX = re.compile("|".join(
+    f"(?P<{intent}>{'|'.join(re.escape(k) for k in keywords)})"
+    for intent, keywords in _INTENT_KEYWORDS.items()
+))
+FAQ_REPLIES = {
+    "greet": GREETING_TEXT,
+    "about": BUSINESS_DESC,
+    "hours": "We’re open from 09:00 to 18:00, Monday to Friday.",
+    "location": "We’re in Sofia. If you need directions, I can have a human text you details.",
+    "services": "We offer consultations and scheduling. Tell me what you need and I’ll help book a slot.",
+    "pricing": "Pricing varies by service. I can connect you with a human to confirm a quote.",
+    "human": "Absolutely—tap “Talk to an agent” and leave your phone. We’ll call you shortly.",
+}
+
+HOURS_HINT_TEXT = f"Our hours are {BUSINESS_HOURS[0]}–{BUSINESS_HOURS[1]}, Mon–Fri. Say ‘availability today’, ‘availability tomorrow’, or a date like 2025-10-05."
+NEED_DATE_TEXT = "Please include a date (YYYY-MM-DD), e.g. ‘book me for a consultation on 2025-10-05 at 14:30’."
+NEED_TIME_TEXT = "Please include a time (HH:MM), e.g. 14:30."
+
+_ALL_OPEN_TEMPLATE = f"{{}}: All times look open between {BUSINESS_HOURS[0]} and {BUSINESS_HOURS[1]}."
+
+# Fixed replies serialized once; canned answers skip JSON encoding per request
+_CANNED_BODIES = {
+    t: orjson.dumps({"reply": t})
+    for t in (EMPTY_TEXT, GREETING_TEXT, HELP_TEXT, HOURS_HINT_TEXT, NEED_DATE_TEXT, NEED_TIME_TEXT, *FAQ_REPLIES.values())
+}
+
+def _json_body(body: bytes) -> Response:
+    # Fresh Response each time: middleware (CORS) mutates headers in place
+    return Response(content=body, media_type="application/json")
+
+# Exact-match small talk answered before any keyword/regex work
+_GREETINGS = frozenset({"hi", "hello", "hey"})
+_HELP_WORDS = frozenset({"help", "?"})
 
 def _iso_today(offset_days: int = 0) -> str:
     return (datetime.utcnow().date() + timedelta(days=offset_days)).isoformat()
 
-def _extract_relative_date(text: str) -> Optional[str]:
-    low = text.lower()
-    if "today" in low:
-        return _iso_today(0)
-    if "tomorrow" in low or "tmrw" in low:
-        return _iso_today(1)
-    return None
-
-def _nice_reply(text: str) -> str:
-    if not OPENAI_API_KEY:
+def _scan_when(msg: str) -> Tuple[Optional[str], Optional[str]]:
+    """First (date, time) in the message; an ISO date beats today, which beats tomorrow."""
+    found: Dict[str, str] = {}
+    for m in WHEN_RX.finditer(msg):
+        found.setdefault(m.lastgroup, m.group())
+    date_str = found.get("date")
+    if date_str is None:
+        if "today" in found:
+            date_str = _iso_today(0)
+        elif "tomorrow" in found:
+            date_str = _iso_today(1)
+    return date_str, found.get("time")
+
+# Byte-identical on every call (no per-request values) so OpenAI can reuse the cached prefix
+_SYSTEM_MSG = {"role": "system", "content": (
+    "You are a concise, warm booking assistant. Keep replies under 120 words.\n"
+    f"Business: {BUSINESS_DESC}\n"
+    f"Opening hours: {BUSINESS_HOURS[0]}–{BUSINESS_HOURS[1]}, Monday to Friday."
+)}
+
+async def _nice_reply(text: str) -> str:
+    client: Optional[AsyncOpenAI] = getattr(app.state, "openai", None)
+    if client is None:
         return text
     try:
-        payload = {
-            "model": "gpt-4o-mini",
-            "messages": [
-                {"role": "system", "content": "You are a concise, warm booking assistant. Keep replies under 120 words."},
-                {"role": "user", "content": text},
-            ],
-            "temperature": 0.2,
-        }
-        req = urllib.request.Request(
-            "https://api.openai.com/v1/chat/completions",
-            data=json.dumps(payload).encode("utf-8"),
-            headers={"Content-Type": "application/json",
-                     "Authorization": f"Bearer {OPENAI_API_KEY}"},
-            method="POST",
+        resp = await client.chat.completions.create(
+            model="gpt-4o-mini",
+            messages=[_SYSTEM_MSG, {"role": "user", "content": text}],
+            temperature=0.2,
         )
-        with urllib.request.urlopen(req, timeout=20) as resp:
-            data = json.loads(resp.read().decode("utf-8"))
-            return data["choices"][0]["message"]["content"].strip()
+        reply = resp.choices[0].message.content.strip()
     except Exception as e:
         print(f"OpenAI nicening failed: {e}")
         return text
+    _log_usage(getattr(resp, "usage", None))
+    return reply
+
+def _log_usage(usage) -> None:
+    # Best-effort: tolerate missing fields or dicts from other SDK versions
+    if usage is None:
+        return
+    details = getattr(usage, "prompt_tokens_details", None)
+    if isinstance(details, dict):
+        cached = details.get("cached_tokens")
+    else:
+        cached = getattr(details, "cached_tokens", None)
+    print(f"🤖 OpenAI prompt tokens: {getattr(usage, 'prompt_tokens', '?')} (cached {cached or 0})")
+
+async def _nice_stream(text: str) -> AsyncIterator[str]:
+    """Like _nice_reply, but yields the rephrasing as OpenAI produces it."""
+    client: Optional[AsyncOpenAI] = getattr(app.state, "openai", None)
+    if client is None:
+        yield text
+        return
+    sent = False
+    try:
+        stream = await client.chat.completions.create(
+            model="gpt-4o-mini",
+            messages=[_SYSTEM_MSG, {"role": "user", "content": text}],
+            temperature=0.2,
+            stream=True,
+        )
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                sent = True
+                yield chunk.choices[0].delta.content
+    except Exception as e:
+        print(f"OpenAI nicening failed: {e}")
+        if not sent:
+            yield text
+
+async def _sse(parts: AsyncIterator[str]) -> AsyncIterator[bytes]:
+    # Each event is one JSON-encoded text delta, so newlines in the reply are safe
+    async for part in parts:
+        yield b"data: " + orjson.dumps(part) + b"\n\n"
+    yield b"data: [DONE]\n\n"
+
+async def _dynamic_reply(text: str, stream: bool):
+    """Rephrase a per-request reply; streamed as SSE when the client asked for it."""
+    if stream:
+        return StreamingResponse(_sse(_nice_stream(text)), media_type="text/event-stream")
+    return {"reply": await _nice_reply(text)}
+
+# Serialized rephrasings of the fixed reply strings above; dynamic replies are never cached.
+# Entries expire so the wording is refreshed now and then rather than frozen for the process lifetime.
+NICE_CACHE_MAX = 256
+NICE_CACHE_TTL = 600.0  # seconds
+_nice_cache: "OrderedDict[str, Tuple[float, bytes]]" = OrderedDict()
+
+async def _canned_reply(text: str) -> Response:
+    hit = _nice_cache.get(text)
+    now = time.monotonic()
+    if hit is not None and hit[0] > now:
+        _nice_cache.move_to_end(text)
+        return _json_body(hit[1])
+    reply = await _nice_reply(text)
+    if reply is text:  # OpenAI off or failed: nothing worth keeping
+        return _json_body(_CANNED_BODIES[text])
+    body = orjson.dumps({"reply": reply})
+    _nice_cache[text] = (now + NICE_CACHE_TTL, body)
+    _nice_cache.move_to_end(text)
+    if len(_nice_cache) > NICE_CACHE_MAX:
+        _nice_cache.popitem(last=False)
+    return _json_body(body)
 
 @app.post("/api/chat")
-async def chat(payload: Dict[str, str]):
-    msg = (payload.get("message") or "").strip()
+async def chat(body: ChatIn, request: Request):
+    msg = body.message.strip()
+    stream = "text/event-stream" in request.headers.get("accept", "")
     if not msg:
-        return {"reply": "Hey! I can check availability, pencil you in, or answer quick questions. Try: ‘availability today’ or ‘book me tomorrow at 10:00’."}
+        return _json_body(_CANNED_BODIES[EMPTY_TEXT])
 
     low = msg.lower()
+    if low in _GREETINGS:
+        return _json_body(_CANNED_BODIES[GREETING_TEXT])
+    if low in _HELP_WORDS or len(low) < 3:
+        return _json_body(_CANNED_BODIES[HELP_TEXT])
+
+    intents = {m.lastgroup for m in INTENT_RX.finditer(low)}
 
     # FAQ / small talk
-    if any(w in low for w in ["hello", "hi ", "hey", "good morning", "good afternoon", "good evening"]):
-        return {"reply": _nice_reply("Hi there! 👋 I can check availability, help you book, or answer quick questions. What can I do for you today?")}
-    if "what kind of business" in low or "who are you" in low or "what is this" in low or "what do you do" in low:
-        return {"reply": _nice_reply(BUSINESS_DESC)}
-    if any(k in low for k in ["hour", "open", "close", "working"]):
-        return {"reply": _nice_reply("We’re open from 09:00 to 18:00, Monday to Friday.")}
-    if any(k in low for k in ["where", "address", "location", "office"]):
-        return {"reply": _nice_reply("We’re in Sofia. If you need directions, I can have a human text you details.")}
-    if "service" in low or "offer" in low:
-        return {"reply": _nice_reply("We offer consultations and scheduling. Tell me what you need and I’ll help book a slot.")}
-    if "price" in low or "cost" in low or "fee" in low:
-        return {"reply": _nice_reply("Pricing varies by service. I can connect you with a human to confirm a quote.")}
-    if "human" in low or "agent" in low or "person" in low or "contact" in low:
-        return {"reply": _nice_reply("Absolutely—tap “Talk to an agent” and leave your phone. We’ll call you shortly.")}
+    for intent, reply in FAQ_REPLIES.items():
+        if intent in intents:
+            return await _canned_reply(reply)
+
+    if "avail" in intents or "book" in intents:
+        date_str, time_str = _scan_when(msg)
 
     # Availability
-    date_match = DATE_RX.search(msg)
-    rel_date = _extract_relative_date(msg)
-    if any(k in low for k in ["avail", "free", "slot", "slots"]):
-        if not (date_match or rel_date):
-            base = f"Our hours are {BUSINESS_HOURS[0]}–{BUSINESS_HOURS[1]}, Mon–Fri. Say ‘availability today’, ‘availability tomorrow’, or a date like 2025-10-05."
-            return {"reply": _nice_reply(base)}
-        date_str = date_match.group(1) if date_match else rel_date
-        taken = list_taken_slots_for_date(date_str)
-        pending = list_pending_slots_for_date(date_str)
+    if "avail" in intents:
+        if not date_str:
+            return await _canned_reply(HOURS_HINT_TEXT)
+        taken, pending = slots_for_date(date_str)
         if not taken and not pending:
-            base = f"{date_str}: All times look open between {BUSINESS_HOURS[0]} and {BUSINESS_HOURS[1]}."
+            base = _ALL_OPEN_TEMPLATE.format(date_str)
         else:
             t = ", ".join(taken) if taken else "none"
             p = ", ".join(pending) if pending else "none"
             base = f"{date_str} — Confirmed (blocked): {t}. Pending: {p}. Tell me a time and I can tentatively book you."
-        return {"reply": _nice_reply(base)}
+        return await _dynamic_reply(base, stream)
 
     # Booking
-    time_rx = re.compile(r"\b([01]\d|2[0-3]):([0-5]\d)\b")
-    if "book" in low or "schedule" in low or "appointment" in low:
-        date_m = DATE_RX.search(msg)
-        if not date_m:
-            rel = _extract_relative_date(msg)
-            if not rel:
-                return {"reply": _nice_reply("Please include a date (YYYY-MM-DD), e.g. ‘book me for a consultation on 2025-10-05 at 14:30’.")}
-            date_str = rel
-        else:
-            date_str = date_m.group(1)
+    if "book" in intents:
+        if not date_str:
+            return await _canned_reply(NEED_DATE_TEXT)
+        if not time_str:
+            return await _canned_reply(NEED_TIME_TEXT)
 
-        time_m = time_rx.search(msg)
-        if not time_m:
-            return {"reply": _nice_reply("Please include a time (HH:MM), e.g. 14:30.")}
+        taken, _ = slots_for_date(date_str)
+        if time_str in taken:
+            return await _dynamic_reply(f"That time ({date_str} {time_str}) is already confirmed. Try another time.", stream)
 
-        time_str = f"{time_m.group(1)}:{time_m.group(2)}"
-        name_m = re.search(r"(?:i am|i'm|name is)\s+([^\.,\n]+)", low) or re.search(r"\bname\s*:\s*([^\.,\n]+)", low)
-        phone_m = re.search(r"(?:phone|tel|mobile|gsm)\s*[:\-]?\s*([\+\d][\d\s\-]{6,})", low)
-        service_m = re.search(r"(?:service|for|need|want)\s+([a-zA-Zа-яА-Я0-9 \-_/]{2,})", msg)
+        # Contact fields only matter once the slot is known to be bookable
+        name_m = NAME_RX.search(low)
+        phone_m = PHONE_RX.search(low)
+        service_m = SERVICE_RX.search(msg)
 
-        name = (name_m.group(1).strip() if name_m else "Guest").title()
+        name = ((name_m.group(1) or name_m.group(2)).strip() if name_m else "Guest").title()
         phone = (phone_m.group(1).strip() if phone_m else "unknown")
         service = (service_m.group(1).strip() if service_m else "service")
 
-        taken = list_taken_slots_for_date(date_str)
-        if time_str in taken:
-            return {"reply": _nice_reply(f"That time ({date_str} {time_str}) is already confirmed. Try another time.")}
-
         lead = Lead(
             name=name, email=None, phone=phone, service=service,
             appointment_date=date_str, appointment_time=time_str
         )
-        booking_id = write_lead("pending", lead)
-
-        confirm_token = _sign("confirm", booking_id)
-        cancel_token = _sign("cancel", booking_id)
-        base_url = PUBLIC_BASE_URL or ""
-        confirm_url = f"{base_url}/confirm/{booking_id}?token={confirm_token}"
-        cancel_url = f"{base_url}/cancel/{booking_id}?token={cancel_token}"
-        subject, text, html = build_owner_email(booking_id, lead, confirm_url, cancel_url)
-        send_via_brevo_api(subject, txt=text, html=html)
+        booking_id = await queue_lead("pending", lead)
+        notify_owner(booking_id, lead)
 
         base = f"Done! I created a pending booking for {name} on {date_str} at {time_str} for ‘{service}’. The owner will confirm shortly."
-        return {"reply": _nice_reply(base)}
-
-    help_text = (
-        "I can check availability or tentatively book you.\n"
-        "• availability today / tomorrow\n"
-        "• availability 2025-10-05\n"
-        "• book me for consultation tomorrow at 14:30, I'm Alex, phone +359…\n"
-        "You can also say “talk to an agent”."
-    )
-    return {"reply": _nice_reply(help_text)}
+        return await _dynamic_reply(base, stream)
+
+    return await _canned_reply(HELP_TEXT)
 
 
 @app.post("/api/confirm/{booking_id}")
 async def api_confirm_booking(booking_id: str):
-    leads = read_all_leads()
-    target = next((r for r in leads if r["booking_id"] == booking_id), None)
+    target = get_lead(booking_id)
     if not target:
-        return JSONResponse({"ok": False, "message": "Booking not found"}, status_code=404)
+        return ORJSONResponse({"ok": False, "message": "Booking not found"}, status_code=404)
     if target["status"] == "confirmed":
         return {"ok": True, "message": "Already confirmed"}
 
-    for r in leads:
-        if (
-            r["booking_id"] != booking_id
-            and r["appointment_date"] == target["appointment_date"]
-            and r["appointment_time"] == target["appointment_time"]
-            and r["status"] == "confirmed"
-        ):
-            return JSONResponse({"ok": False, "message": "Time slot already confirmed for another booking."}, status_code=409)
-
-    update_booking_status(booking_id, "confirmed")
+    if not confirm_if_slot_free(booking_id):
+        return ORJSONResponse({"ok": False, "message": "Time slot already confirmed for another booking."}, status_code=409)
 
     try:
         to_email = (target.get("email") or "").strip()
         if to_email:
-            promo = os.getenv("PROMO_CODE") or "NEXA10"
-            pay_link = (os.getenv("PAYMENT_LINK_BASE") or "").strip()
-            if pay_link:
-                pay_link = f"{pay_link}?booking={booking_id}&discount=10&code={promo}"
-
-            subject = "Your booking is confirmed"
-            txt = (
-                f"Hi {target.get('name')},\n\n"
-                f"Your booking for {target.get('service')} on {target.get('appointment_date')} at {target.get('appointment_time')} is confirmed.\n"
-            )
-            if pay_link:
-                txt += f"Optional: pay now with 10% off using code {promo}: {pay_link}\n"
-
-            inner = (
-                f"<p>Hi {target.get('name')},</p>"
-                f"<p>Your booking for <b>{target.get('service')}</b> on <b>{target.get('appointment_date')}</b> at <b>{target.get('appointment_time')}</b> is confirmed.</p>"
-                + (f"<p><a href='{pay_link}'>Pay now with 10% off (code {promo})</a></p>" if pay_link else "")
-            )
-            try:
-                html = _wrap_email_html("Booking Confirmed", inner)  # type: ignore
-            except Exception:
-                html = inner
-
-            send_via_brevo_api(subject, txt, html, to_email=to_email)
+            pay_link = f"{PAYMENT_LINK_BASE}?booking={booking_id}&discount=10&code={PROMO_CODE}" if PAYMENT_LINK_BASE else ""
+            queue_email(*build_customer_email("confirmed", target, pay_link), to_email=to_email)
     except Exception as e:
         print("Email confirm send failed:", e)
 
@@ -693,30 +1105,13 @@ async def api_confirm_booking(booking_id: str):
 async def api_cancel_booking(booking_id: str):
     ok = update_booking_status(booking_id, "cancelled")
     if not ok:
-        return JSONResponse({"ok": False, "message": "Booking not found"}, status_code=404)
+        return ORJSONResponse({"ok": False, "message": "Booking not found"}, status_code=404)
 
     try:
-        leads = read_all_leads()
-        target = next((r for r in leads if r["booking_id"] == booking_id), None)
+        target = get_lead(booking_id)
         to_email = (target.get("email") or "").strip() if target else ""
         if to_email:
-            subject = "Your booking was cancelled"
-            txt = (
-                f"Hi {target.get('name')},\n\n"
-                f"Your booking for {target.get('service')} on {target.get('appointment_date')} at {target.get('appointment_time')} was cancelled.\n"
-                "If this is unexpected, reply to this email."
-            )
-            inner = (
-                f"<p>Hi {target.get('name')},</p>"
-                f"<p>Your booking for <b>{target.get('service')}</b> on <b>{target.get('appointment_date')}</b> at <b>{target.get('appointment_time')}</b> was cancelled.</p>"
-                "<p>If this is unexpected, reply to this email.</p>"
-            )
-            try:
-                html = _wrap_email_html("Booking Cancelled", inner)  # type: ignore
-            except Exception:
-                html = inner
-
-            send_via_brevo_api(subject, txt, html, to_email=to_email)
+            queue_email(*build_customer_email("cancelled", target), to_email=to_email)
     except Exception as e:
         print("Email cancel send failed:", e)
 
@@ -724,10 +1119,11 @@ async def api_cancel_booking(booking_id: str):
 
 
 @app.post("/admin/login")
+@app.post("/api/admin/login")
 async def admin_login(request: Request):
     username = password = ""
     try:
-        data = await request.json()
+        data = orjson.loads(await request.body())
         username = (data.get("username") or "").strip()
         password = (data.get("password") or "").strip()
     except Exception:
@@ -737,11 +1133,14 @@ async def admin_login(request: Request):
         username = (form.get("username") or "").strip()
         password = (form.get("password") or "").strip()
 
-    if username == ADMIN_USER and password == ADMIN_PASS:
+    # non-short-circuiting & so a wrong username costs the same as a wrong password
+    user_ok = hmac.compare_digest(username.encode("utf-8"), _ADMIN_USER_BYTES)
+    pass_ok = hmac.compare_digest(password.encode("utf-8"), _ADMIN_PASS_BYTES)
+    if user_ok & pass_ok:
         token = create_session(username)
         accept = request.headers.get("accept", "")
         if "application/json" in accept or request.headers.get("x-requested-with"):
-            resp = JSONResponse({"ok": True})
+            resp = ORJSONResponse({"ok": True})
         else:
             resp = RedirectResponse(url="/public/admin.html", status_code=302)
         resp.set_cookie("admin_session", token, max_age=60*60*24*7, httponly=True, samesite="None", secure=True, path="/")
@@ -749,13 +1148,9 @@ async def admin_login(request: Request):
 
     accept = request.headers.get("accept", "")
     if "application/json" in accept or request.headers.get("x-requested-with"):
-        return JSONResponse({"ok": False, "error": "invalid"}, status_code=401)
+        return ORJSONResponse({"ok": False, "error": "invalid"}, status_code=401)
     return RedirectResponse(url="/admin/login.html?error=Invalid+credentials", status_code=302)
 
-@app.post("/api/admin/login")
-async def admin_login_alias(request: Request):
-    return await admin_login(request)
-
 @app.get("/admin/logout")
 async def admin_logout():
     resp = RedirectResponse(url="/admin/login.html", status_code=302)
@@ -785,7 +1180,9 @@ async def dev_create_pay_link(
     description: str = "Booking payment – 10% online discount",
 ):
     try:
-        url = create_checkout_url(
+        # stripe-python is blocking; keep it off the event loop
+        url = await run_in_threadpool(
+            create_checkout_url,
             amount_cents=amount_cents,
             email=to_email,
             description=description,
@@ -795,3 +1192,15 @@ async def dev_create_pay_link(
     except Exception as e:
         print(f"[Stripe] Error: {e}")
         return PlainTextResponse("Failed to create Stripe session. Check logs.", status_code=500)
+
+if __name__ == "__main__":
+    import uvicorn
+    # One process per core; SQLite WAL + the conditional confirm keep workers consistent
+    uvicorn.run(
+        "app:app",
+        host="0.0.0.0",
+        port=int(os.getenv("PORT") or "8000"),
+        workers=int(os.getenv("WEB_CONCURRENCY") or os.cpu_count() or 1),
+        loop="auto",  # uvloop / httptools when installed (uvicorn[standard]), asyncio / h11 otherwise
+        http="auto",
+    )